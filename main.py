@@ -10,12 +10,23 @@ unit-testable.
 """
 from __future__ import annotations
 
+import argparse
+import asyncio
 import concurrent.futures
+import functools
+import itertools
 import os
-import shlex
-from dataclasses import dataclass
+import platform
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable
 
-from utils import find_audio_files, process_path, rename_folder_by_album, DEFAULT_EXTENSIONS
+from tqdm import tqdm
+
+from utils import (
+    find_audio_files, get_majority_album, imaging_backend, pillow_simd_active, process_paths,
+    rename_folder_to_album, DEFAULT_EXTENSIONS,
+)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -30,7 +41,10 @@ class Config:
     do_embed: bool = True
     do_rename: bool = False
     do_rename_folders: bool = False
-    workers: int = 4
+    jpeg_quality: int = 90
+    jpeg_subsampling: int = 2  # 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0
+    jpeg_optimize: bool = False  # extra Huffman pass: ~3% smaller, ~2x slower encode
+    workers: int = field(default_factory=lambda: os.cpu_count() or 4)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -38,24 +52,30 @@ class Config:
 # ─────────────────────────────────────────────────────────────────────────────
 
 def clear_screen() -> None:
-    """Clear the terminal screen."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    """Clear the terminal screen with an ANSI escape (no subshell)."""
+    sys.stdout.write("\x1b[2J\x1b[H")
+    sys.stdout.flush()
+
+
+_MENU_TEMPLATE = "\n".join([
+    "",
+    "=" * 50,
+    "   AUDIO FILE COVER ART & RENAME UTILITY",
+    "=" * 50,
+    "",
+    "  [1] Embed cover art only",
+    "  [2] Rename files only",
+    "  [3] Embed + Rename",
+    "  [4] Rename folders by album metadata",
+    "  [0] Exit",
+    "",
+    "-" * 50,
+]) + "\n"
 
 
 def print_menu() -> None:
     """Display the main menu."""
-    print()
-    print("=" * 50)
-    print("   AUDIO FILE COVER ART & RENAME UTILITY")
-    print("=" * 50)
-    print()
-    print("  [1] Embed cover art only")
-    print("  [2] Rename files only")
-    print("  [3] Embed + Rename")
-    print("  [4] Rename folders by album metadata")
-    print("  [0] Exit")
-    print()
-    print("-" * 50)
+    sys.stdout.write(_MENU_TEMPLATE)
 
 
 def parse_path(raw: str) -> str:
@@ -72,7 +92,12 @@ def parse_path(raw: str) -> str:
        (raw.startswith("'") and raw.endswith("'")):
         return raw[1:-1]
     
+    # Nothing left for a shell lexer to interpret
+    if "\\" not in raw and '"' not in raw and "'" not in raw:
+        return raw
+    
     # Try shlex for more complex quoting
+    import shlex
     try:
         parts = shlex.split(raw)
         if parts:
@@ -101,13 +126,23 @@ def prompt_directory() -> str:
         print("  Please try again.\n")
 
 
-def prompt_choice(prompt: str, valid: set[str]) -> str:
+_MENU_CHOICES = frozenset({"0", "1", "2", "3", "4"})
+_YN_CHOICES = frozenset({"", "y", "n", "Y", "N"})
+
+
+@functools.lru_cache(maxsize=None)
+def _choices_text(valid: frozenset[str]) -> str:
+    """Sorted, comma-separated options for the invalid-choice message."""
+    return ', '.join(sorted(valid))
+
+
+def prompt_choice(prompt: str, valid: frozenset[str]) -> str:
     """Prompt for a single choice from valid options."""
     while True:
         choice = input(prompt).strip()
         if choice in valid:
             return choice
-        print(f"  [!] Invalid option. Choose from: {', '.join(sorted(valid))}")
+        print(f"  [!] Invalid option. Choose from: {_choices_text(valid)}")
 
 
 def run_interactive() -> Config | None:
@@ -118,7 +153,7 @@ def run_interactive() -> Config | None:
     clear_screen()
     print_menu()
     
-    choice = prompt_choice("  Select option: ", {"0", "1", "2", "3", "4"})
+    choice = prompt_choice("  Select option: ", _MENU_CHOICES)
     
     if choice == "0":
         return None
@@ -141,13 +176,13 @@ def run_interactive() -> Config | None:
     # Ask for backup if embedding
     if config.do_embed:
         print()
-        bk = prompt_choice("  Create backup before modifying? [y/N]: ", {"", "y", "n", "Y", "N"})
+        bk = prompt_choice("  Create backup before modifying? [y/N]: ", _YN_CHOICES)
         config.backup = bk.lower() == "y"
     
     return config
 
 
-def print_summary(config: Config, file_count: int) -> None:
+def print_summary(config: Config) -> None:
     """Display processing summary."""
     ops = []
     if config.do_embed:
@@ -157,20 +192,27 @@ def print_summary(config: Config, file_count: int) -> None:
     if config.do_rename_folders:
         ops.append("Rename Folders")
     
-    print()
-    print("-" * 50)
-    print("  SUMMARY")
-    print("-" * 50)
-    print(f"  Directory : {config.directory}")
-    print(f"  Files     : {file_count}")
-    print(f"  Operation : {' + '.join(ops)}")
-    print(f"  Backup    : {'Yes' if config.backup else 'No'}")
-    print("-" * 50)
+    lines = [
+        "",
+        "-" * 50,
+        "  SUMMARY",
+        "-" * 50,
+        f"  Directory : {config.directory}",
+        f"  Operation : {' + '.join(ops)}",
+        f"  Backup    : {'Yes' if config.backup else 'No'}",
+    ]
+    if config.do_embed:
+        lines.append(f"  Imaging   : {imaging_backend()}")
+    lines.append("-" * 50)
+    if config.do_embed and platform.machine().lower() in ("x86_64", "amd64") \
+            and not pillow_simd_active():
+        lines.append("  Tip: install pillow-simd for faster cover resizing")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def confirm_proceed() -> bool:
     """Ask user to confirm before processing."""
-    choice = prompt_choice("\n  Proceed? [Y/n]: ", {"", "y", "n", "Y", "N"})
+    choice = prompt_choice("\n  Proceed? [Y/n]: ", _YN_CHOICES)
     return choice.lower() != "n"
 
 
@@ -178,35 +220,32 @@ def confirm_proceed() -> bool:
 # File Processing
 # ─────────────────────────────────────────────────────────────────────────────
 
-def process_files(files: list[str], config: Config) -> tuple[int, int, int]:
+def process_files(files: Iterable[str], config: Config) -> tuple[int, int, int, int]:
     """
     Process all files with the given configuration.
-    Returns (processed_count, skipped_count, error_count).
+    `files` may be a lazy iterable (e.g. straight from find_audio_files) so the
+    directory walk overlaps with processing.
+    Returns (total_count, processed_count, skipped_count, error_count).
     """
-    total = len(files)
+    total = 0
     processed = 0
     skipped = 0
     errors = 0
     
-    print(f"\n  Processing {total} files...\n")
+    print("\n  Processing files...\n")
     
-    if config.workers > 1:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=config.workers) as executor:
-            futures = {executor.submit(process_path, fpath, config): fpath for fpath in files}
-            
-            for future in concurrent.futures.as_completed(futures):
-                status, path, msg = future.result()
-                processed, skipped, errors = _update_counters(
-                    status, path, msg, processed, skipped, errors
-                )
-    else:
-        for fpath in files:
-            status, path, msg = process_path(fpath, config)
-            processed, skipped, errors = _update_counters(
-                status, path, msg, processed, skipped, errors
-            )
+    results = process_paths(files, config, config.workers)
+    for status, path, msg in tqdm(results, unit="file"):
+        total += 1
+        processed, skipped, errors = _update_counters(
+            status, path, msg, processed, skipped, errors
+        )
     
-    return processed, skipped, errors
+    # Embeds skip per-file fsync; flush everything once instead.
+    if config.do_embed and hasattr(os, "sync"):
+        os.sync()
+    
+    return total, processed, skipped, errors
 
 
 def _update_counters(
@@ -219,25 +258,28 @@ def _update_counters(
         processed += 1
     elif status == "skipped":
         skipped += 1
-        print(f"  [-] Skipped: {filename} ({msg})")
+        tqdm.write(f"  [-] Skipped: {filename} ({msg})")
     else:
         errors += 1
-        print(f"  [!] Error: {filename} - {msg}")
+        tqdm.write(f"  [!] Error: {filename} - {msg}")
     
     return processed, skipped, errors
 
 
 def print_results(total: int, processed: int, skipped: int, errors: int) -> None:
     """Display final processing results."""
-    print()
-    print("=" * 50)
-    print("  RESULTS")
-    print("=" * 50)
-    print(f"  Total     : {total}")
-    print(f"  Processed : {processed}")
-    print(f"  Skipped   : {skipped}")
-    print(f"  Errors    : {errors}")
-    print("=" * 50)
+    lines = [
+        "",
+        "=" * 50,
+        "  RESULTS",
+        "=" * 50,
+        f"  Total     : {total}",
+        f"  Processed : {processed}",
+        f"  Skipped   : {skipped}",
+        f"  Errors    : {errors}",
+        "=" * 50,
+    ]
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -246,48 +288,81 @@ def print_results(total: int, processed: int, skipped: int, errors: int) -> None
 
 def get_immediate_subdirs(root: str) -> list[str]:
     """Get all immediate subdirectories in root."""
-    subdirs = []
     try:
-        for entry in os.scandir(root):
-            if entry.is_dir():
-                subdirs.append(entry.path)
+        with os.scandir(root) as it:
+            return [e.path for e in it if e.is_dir()]
     except Exception as e:
         print(f"  [!] Error scanning directory: {e}")
-    return subdirs
+        return []
 
 
-def process_folders(root: str) -> tuple[int, int, int]:
+def process_folders(root: str, workers: int = 4) -> tuple[int, int, int, int]:
     """
     Rename folders based on album metadata.
-    Returns (processed_count, skipped_count, error_count).
+    Returns (total_count, processed_count, skipped_count, error_count).
     """
     folders = get_immediate_subdirs(root)
     
     if not folders:
         print("\n  No subdirectories found.")
-        return 0, 0, 0
+        return 0, 0, 0, 0
+    
+    print(f"\n  Processing {len(folders)} folders...\n")
     
+    processed, skipped, errors = asyncio.run(_process_folders_async(folders, workers))
+    
+    return len(folders), processed, skipped, errors
+
+
+async def _lookup_album(
+    loop: asyncio.AbstractEventLoop, pool: concurrent.futures.Executor, folder: str
+) -> tuple[str, str | None, str | None]:
+    """
+    Resolve a folder's majority album on the thread pool.
+    Returns (folder, album, error); a failed lookup is reported, not raised,
+    so one unreadable folder does not stop the batch.
+    """
+    try:
+        album = await loop.run_in_executor(pool, get_majority_album, folder)
+    except Exception as e:
+        return folder, None, str(e)
+    return folder, album, None
+
+
+async def _process_folders_async(folders: list[str], workers: int) -> tuple[int, int, int]:
+    """
+    Look up albums concurrently and rename each folder as soon as its lookup
+    finishes. Returns (processed_count, skipped_count, error_count).
+    """
     processed = 0
     skipped = 0
     errors = 0
     
-    print(f"\n  Processing {len(folders)} folders...\n")
-    
-    for folder in folders:
-        status, old_path, new_path_or_msg = rename_folder_by_album(folder)
-        
-        folder_name = os.path.basename(old_path)
-        
-        if status == "processed":
-            processed += 1
-            new_name = os.path.basename(new_path_or_msg)
-            print(f"  ✓ Renamed: {folder_name} → {new_name}")
-        elif status == "skipped":
-            skipped += 1
-            print(f"  [-] Skipped: {folder_name} ({new_path_or_msg})")
-        else:
-            errors += 1
-            print(f"  [!] Error: {folder_name} - {new_path_or_msg}")
+    loop = asyncio.get_running_loop()
+    # Album lookups are I/O-bound, so oversubscribe threads for them. Renames
+    # run here on the event loop, one at a time, so siblings cannot race for
+    # a name.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(8, workers * 2)) as pool:
+        lookups = [_lookup_album(loop, pool, folder) for folder in folders]
+        for next_done in asyncio.as_completed(lookups):
+            folder, album, error = await next_done
+            if error is not None:
+                status, old_path, new_path_or_msg = "error", folder, error
+            else:
+                status, old_path, new_path_or_msg = rename_folder_to_album(folder, album)
+            
+            folder_name = os.path.basename(old_path)
+            
+            if status == "processed":
+                processed += 1
+                new_name = os.path.basename(new_path_or_msg)
+                print(f"  ✓ Renamed: {folder_name} → {new_name}")
+            elif status == "skipped":
+                skipped += 1
+                print(f"  [-] Skipped: {folder_name} ({new_path_or_msg})")
+            else:
+                errors += 1
+                print(f"  [!] Error: {folder_name} - {new_path_or_msg}")
     
     return processed, skipped, errors
 
@@ -296,8 +371,28 @@ def process_folders(root: str) -> tuple[int, int, int]:
 # Main Entry Point
 # ─────────────────────────────────────────────────────────────────────────────
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the few command-line options; everything else is asked interactively."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workers", type=int, metavar="N",
+        help="parallel workers for file and folder processing (default: CPU count)",
+    )
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
 def main() -> None:
     """Main entry point with interactive numbered menu."""
+    args = parse_args()
+    
+    if os.name == "nt":
+        # Running an empty command once turns on ANSI escape handling in
+        # the Windows console for the rest of the session.
+        os.system("")
+    
     try:
         config = run_interactive()
         
@@ -305,19 +400,23 @@ def main() -> None:
             print("\n  Goodbye!")
             return
         
+        if args.workers is not None:
+            config.workers = args.workers
+        
         # Handle folder renaming separately
         if config.do_rename_folders:
-            processed, skipped, errors = process_folders(config.directory)
-            print_results(len(get_immediate_subdirs(config.directory)), processed, skipped, errors)
+            total, processed, skipped, errors = process_folders(config.directory, config.workers)
+            print_results(total, processed, skipped, errors)
             return
         
-        # Find audio files
-        files = list(find_audio_files(config.directory, DEFAULT_EXTENSIONS))
+        # Find audio files lazily; only peek far enough to know there are any
+        files = find_audio_files(config.directory, DEFAULT_EXTENSIONS)
+        first = next(files, None)
         
         # Show summary
-        print_summary(config, len(files))
+        print_summary(config)
         
-        if len(files) == 0:
+        if first is None:
             print("\n  No audio files found.")
             return
         
@@ -327,10 +426,12 @@ def main() -> None:
             return
         
         # Process files
-        processed, skipped, errors = process_files(files, config)
+        total, processed, skipped, errors = process_files(
+            itertools.chain((first,), files), config
+        )
         
         # Show results
-        print_results(len(files), processed, skipped, errors)
+        print_results(total, processed, skipped, errors)
         
     except KeyboardInterrupt:
         print("\n\n  Cancelled by user.")
@@ -6,24 +6,103 @@ This module contains the image processing and tag-manipulation helpers used by
 """
 from __future__ import annotations
 
-import base64
+import binascii
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import io
+import itertools
+import json
+import mmap
 import os
 import re
 import shutil
-from typing import Optional, Tuple
+import sqlite3
+import sys
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import IO, Callable, Iterable, Iterator, Literal, NamedTuple, Optional, Tuple, Union
 
+import PIL
 from PIL import Image, ImageOps
 
 try:
     from mutagen import File
-    from mutagen.id3 import ID3, APIC, ID3NoHeaderError
+    from mutagen.id3 import ID3, APIC, TAL, TALB, ID3NoHeaderError
     from mutagen.mp4 import MP4, MP4Cover
-    from mutagen.flac import FLAC, Picture
+    from mutagen.flac import FLAC, Picture, VCFLACDict
     from mutagen.oggvorbis import OggVorbis
 except Exception:
     raise SystemExit("Missing required packages. Install with: pip install -r requirements.txt")
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+# Optional: libjpeg-turbo bindings for a faster JPEG encode than Pillow's save().
+try:
+    import numpy as np
+    import simplejpeg
+except ImportError:
+    np = None  # type: ignore[assignment]
+    simplejpeg = None
+
+# Optional: PyTurboJPEG, tried when simplejpeg is missing. TurboJPEG() raises
+# if the libturbojpeg shared library itself cannot be found.
+try:
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJFLAG_FASTDCT
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbojpeg = None
+
+
+_EXIF_ORIENTATION = 0x0112
+_FLAC_VORBIS_COMMENT = 4
+_FICLONE = 0x40049409  # linux/fs.h: share extents with another file
+_SIMPLEJPEG_SUBSAMPLING = {0: "444", 1: "422", 2: "420"}
+
+# Leading bytes of common cover formats -> MIME type. JPEG is matched on the
+# SOI marker alone since the next marker varies (APP0-APP15, COM, DQT, ...).
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+_MAGIC_SCAN_LIMIT = 4096
+
+# Bits per pixel recorded in FLAC/Ogg picture blocks, by image mode
+_PICTURE_DEPTH = {"RGB": 24, "RGBA": 32, "L": 8, "P": 8}
+
+# ID3v2 text encodings 0-3
+_ID3_TEXT_CODECS = ("latin-1", "utf-16", "utf-16-be", "utf-8")
+
+_buffers = threading.local()
+
+_LEADING_DIGITS = re.compile(r"(\d+)")
+_SANITIZE_BAD = re.compile(r"[^\w \-\.()\[\]]+")
+_SANITIZE_WS = re.compile(r"\s+")
+_PATH_SEPARATORS = str.maketrans({"/": "_", "\\": "_"})
+
+# WaitForMultipleObjects limit, less the pool's own handles
+_WIN32_MAX_PROCESS_WORKERS = 61
+
+# Tag scans memory-map files at least this large
+_MMAP_MIN_SIZE = 1 << 20
+
+# Embeds parse files smaller than this from memory (see _open_tags)
+_PREREAD_MAX_SIZE = 50 << 20
+_PREREAD_EXTENSIONS = frozenset({".mp3", ".m4a", ".mp4", ".flac", ".ogg", ".opus"})
+
+# Marks files whose cover is already normalized so re-runs can skip them.
+_MARKER_XATTR = "user.coverart_norm"
+_MARKER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "music-album-scaler")
+_SEEN_DB = os.path.join(_MARKER_CACHE_DIR, "seen.sqlite3")
+_seen = threading.local()
 
 DEFAULT_EXTENSIONS = {
     ".mp3",
@@ -38,102 +117,316 @@ DEFAULT_EXTENSIONS = {
 }
 
 
-def find_audio_files(root: str, exts=DEFAULT_EXTENSIONS):
-    for dirpath, dirs, files in os.walk(root):
-        for name in files:
-            _, ext = os.path.splitext(name)
-            if ext.lower() in exts:
-                yield os.path.join(dirpath, name)
+def pillow_simd_active() -> bool:
+    """Return True if the installed PIL is the SIMD-accelerated Pillow-SIMD fork."""
+    version = PIL.__version__
+    return "simd" in version or ".post" in version
+
 
+def imaging_backend() -> str:
+    """Describe the image libraries in use, e.g. 'Pillow-SIMD 9.5.0.post1 + simplejpeg'."""
+    name = "Pillow-SIMD" if pillow_simd_active() else "Pillow"
+    backend = f"{name} {PIL.__version__}"
+    if simplejpeg is not None:
+        backend += " + simplejpeg"
+    elif _turbojpeg is not None:
+        backend += " + PyTurboJPEG"
+    return backend
+
+
+def find_audio_files(
+    root: str, exts: Iterable[str] = DEFAULT_EXTENSIONS, recursive: bool = True,
+) -> Iterator[str]:
+    """Yield paths of files under root whose extension is in exts.
+
+    With recursive=False only root's own entries are listed.
+
+    Walks with os.scandir: DirEntry type checks use the d_type cached from the
+    directory listing, so regular entries cost no extra stat() call.
+    """
+    suffixes = tuple("." + e.lstrip(".").lower() for e in exts)
+    yield from _scan_audio_files(root, suffixes, recursive)
 
-def extract_cover_bytes(path: str) -> Optional[Tuple[bytes, str]]:
-    """Return (image_bytes, mime) if a cover exists, otherwise None."""
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
 
+def _scan_audio_files(
+    dirpath: str, suffixes: Tuple[str, ...], recursive: bool = True,
+) -> Iterator[str]:
+    # Snapshot the listing first: callers may rename files in this directory
+    # while the generator is suspended, and readdir() could then see them twice.
     try:
-        if ext == ".mp3":
-            try:
-                tags = ID3(path)
-            except ID3NoHeaderError:
-                return None
-            apics = tags.getall("APIC")
-            if not apics:
-                return None
-            data = apics[0].data
-            mime = apics[0].mime
-            return data, mime
-
-        elif ext in (".m4a", ".mp4"):
-            mp4 = MP4(path)
-            covr = mp4.tags.get("covr")
-            if not covr:
-                return None
-            data = bytes(covr[0])
-            mime = "image/jpeg" if data[:3] == b"\xff\xd8\xff" else "image/png"
-            return data, mime
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError:
+        return
+    # Name order keeps each album's tracks together and in sequence, so the
+    # shared cover cache hits back to back, and makes runs reproducible.
+    entries.sort(key=lambda e: e.name)
+    subdirs = []
+    for entry in entries:
+        # One C-level endswith over all suffixes; a bare ".mp3" is not a match.
+        name = entry.name.lower()
+        if name.endswith(suffixes) and name not in suffixes and entry.is_file():
+            yield entry.path
+        elif recursive and entry.is_dir(follow_symlinks=False):
+            subdirs.append(entry.path)
+    for sub in subdirs:
+        yield from _scan_audio_files(sub, suffixes)
 
-        elif ext == ".flac":
-            fl = FLAC(path)
-            if not fl.pictures:
-                return None
-            pic = fl.pictures[0]
-            return pic.data, pic.mime
-
-        elif ext in (".ogg", ".opus"):
-            ogg = OggVorbis(path)
-            key = None
-            for k in ogg.keys():
-                if k.lower() == "metadata_block_picture":
-                    key = k
-                    break
-            if not key:
-                return None
-            b64 = ogg.get(key)
-            if not b64:
-                return None
-            raw = base64.b64decode(b64[0])
-            p = Picture()
-            try:
-                p.parse(raw)
-                return p.data, p.mime
-            except Exception:
-                start = raw.find(b"\xff\xd8\xff")
-                if start != -1:
-                    return raw[start:], "image/jpeg"
-                start = raw.find(b"\x89PNG")
-                if start != -1:
-                    return raw[start:], "image/png"
-                return None
 
-        else:
-            f = File(path)
-            if f is None:
-                return None
-            if hasattr(f, "tags") and f.tags:
-                try:
-                    apics = f.tags.getall("APIC")
-                    if apics:
-                        return apics[0].data, apics[0].mime
-                except Exception:
-                    pass
-            return None
+def _open_tags(path: str, ext: Optional[str] = None, preread: bool = False):
+    """Load the mutagen object the tag helpers work on for path's format.
+
+    MP3 files without an ID3 header get an empty ID3 so a cover can be added.
+
+    With preread=True a file under _PREREAD_MAX_SIZE is read in one call and
+    parsed from memory instead of through many small reads and seeks. Only
+    worth it when the whole file is about to be read anyway, as an embed does.
+    """
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
+    source: Union[str, IO[bytes]] = path
+    if preread and ext in _PREREAD_EXTENSIONS and os.path.getsize(path) < _PREREAD_MAX_SIZE:
+        with open(path, "rb") as f:
+            source = io.BytesIO(f.read())
+    if ext == ".mp3":
+        try:
+            return ID3(source)
+        except ID3NoHeaderError:
+            return ID3()
+    if ext in (".m4a", ".mp4"):
+        return MP4(source)
+    if ext == ".flac":
+        return FLAC(source)
+    if ext in (".ogg", ".opus"):
+        return OggVorbis(source)
+    return File(path)
+
+
+def _sniff_mime(data: bytes) -> Optional[str]:
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _cover_mp3(tags) -> Optional[Tuple[bytes, str]]:
+    apics = tags.getall("APIC")
+    if not apics:
+        return None
+    return apics[0].data, apics[0].mime
+
+
+def _cover_mp4(mp4) -> Optional[Tuple[bytes, str]]:
+    covr = mp4.tags.get("covr")
+    if not covr:
+        return None
+    data = covr[0]  # MP4Cover is a bytes subclass; no need to copy it
+    return data, _sniff_mime(data) or "image/png"
+
+
+def _cover_flac(fl) -> Optional[Tuple[bytes, str]]:
+    if not fl.pictures:
+        return None
+    pic = fl.pictures[0]
+    return pic.data, pic.mime
+
+
+def _cover_ogg(ogg) -> Optional[Tuple[bytes, str]]:
+    key = None
+    for k in ogg.keys():
+        if k.lower() == "metadata_block_picture":
+            key = k
+            break
+    if not key:
+        return None
+    b64 = ogg.get(key)
+    if not b64:
+        return None
+    raw = binascii.a2b_base64(b64[0])
+    p = Picture()
+    try:
+        p.parse(raw)
+        return p.data, p.mime
+    except Exception:
+        mime = _sniff_mime(raw)
+        if mime is not None:
+            return raw, mime
+        # A picture block puts the image within its first few hundred bytes,
+        # so never scan a whole multi-megabyte blob for the magic.
+        start = raw.find(b"\xff\xd8\xff", 0, _MAGIC_SCAN_LIMIT)
+        if start != -1:
+            return raw[start:], "image/jpeg"
+        start = raw.find(b"\x89PNG", 0, _MAGIC_SCAN_LIMIT)
+        if start != -1:
+            return raw[start:], "image/png"
+        return None
+
+
+def _cover_generic(f) -> Optional[Tuple[bytes, str]]:
+    if f is None:
+        return None
+    if hasattr(f, "tags") and f.tags:
+        try:
+            apics = f.tags.getall("APIC")
+            if apics:
+                return apics[0].data, apics[0].mime
+        except Exception:
+            pass
+    return None
+
+
+_COVER_READERS = {
+    ".mp3": _cover_mp3,
+    ".m4a": _cover_mp4,
+    ".mp4": _cover_mp4,
+    ".flac": _cover_flac,
+    ".ogg": _cover_ogg,
+    ".opus": _cover_ogg,
+}
+
+
+def extract_cover_bytes(
+    path: str, handle=None, ext: Optional[str] = None,
+) -> Optional[Tuple[bytes, str]]:
+    """Return (image_bytes, mime) if a cover exists, otherwise None.
+
+    `handle` may be the object _open_tags(path) returns, to skip re-parsing,
+    and `ext` path's lower-cased extension if the caller already has it.
+    """
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
+
+    try:
+        tags = handle if handle is not None else _open_tags(path, ext)
+        return _COVER_READERS.get(ext, _cover_generic)(tags)
     except Exception as e:
         print(f"Warning: failed to read tags from {path}: {e}")
         return None
 
 
-def process_image_to_jpeg(img_bytes: bytes, target_width: int = 600, quality: int = 95) -> bytes:
+def _encode_buffer() -> io.BytesIO:
+    """Per-thread scratch buffer reused for every JPEG encode.
+
+    It is rewound but not truncated: truncating would free the allocation,
+    so readers must stop at tell().
+    """
+    buf = getattr(_buffers, "jpeg", None)
+    if buf is None:
+        buf = _buffers.jpeg = io.BytesIO()
+    buf.seek(0)
+    return buf
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    """Orientation tag from the IFD0 of an EXIF TIFF block (1 if absent)."""
+    order: Literal["little", "big"]
+    if tiff[:2] == b"II":
+        order = "little"
+    elif tiff[:2] == b"MM":
+        order = "big"
+    else:
+        return 1
+    ifd = int.from_bytes(tiff[4:8], order)
+    count = int.from_bytes(tiff[ifd:ifd + 2], order)
+    for n in range(count):
+        entry = ifd + 2 + 12 * n
+        if int.from_bytes(tiff[entry:entry + 2], order) == _EXIF_ORIENTATION:
+            return int.from_bytes(tiff[entry + 8:entry + 10], order)
+    return 1
+
+
+def _passthrough_jpeg_size(img_bytes: bytes, target_width: int) -> Optional[Tuple[int, int]]:
+    """(width, height) if img_bytes can be embedded as-is, else None.
+
+    Walks the JPEG marker segments instead of opening the image: the file must
+    be a baseline 8-bit three-component JPEG no wider than target_width whose
+    EXIF orientation (if any) is 1. Anything unusual returns None and goes
+    through the full Pillow path.
+    """
+    data = img_bytes
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    end = len(data)
+    while i + 4 <= end:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:  # no payload
+            i += 2
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        body = i + 4
+        if length < 2 or i + 2 + length > end:  # truncated or corrupt segment
+            return None
+        if marker == 0xE1 and data[body:body + 6] == b"Exif\x00\x00":
+            if _exif_orientation(data[body + 6:i + 2 + length]) != 1:
+                return None
+        elif marker in (0xC0, 0xC1):  # baseline / extended sequential
+            if length < 8 or data[body] != 8 or data[body + 5] != 3:
+                return None
+            height = int.from_bytes(data[body + 1:body + 3], "big")
+            width = int.from_bytes(data[body + 3:body + 5], "big")
+            if 0 < width <= target_width and height > 0:
+                return width, height
+            return None
+        elif 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return None  # progressive, lossless or arithmetic coded
+        elif marker in (0xD9, 0xDA):  # end of image / start of scan before SOF
+            return None
+        i += 2 + length
+    return None
+
+
+class JpegCover(NamedTuple):
+    """Encoded cover plus the dimensions picture blocks need."""
+    data: bytes
+    width: int
+    height: int
+    mode: str
+
+
+def process_image_to_jpeg(
+    img_bytes: bytes,
+    target_width: int = 600,
+    quality: int = 90,
+    optimize: bool = False,
+    subsampling: int = 2,
+) -> JpegCover:
     """Convert image bytes to a baseline JPEG.
 
+    Returns a JpegCover so callers get the final size without decoding again.
+
     Behavior:
     - If image width > target_width, downscale to target_width (preserve aspect ratio).
     - If image width <= target_width, keep original dimensions (no upscaling).
+    - A baseline RGB JPEG that already fits is returned unchanged.
     - Respect EXIF orientation, flatten alpha, preserve ICC profile when present.
-    - Save as baseline (non-progressive) JPEG with given quality.
+    - Save as baseline (non-progressive) JPEG with given quality; progressive
+      covers are not shown by some car stereos and portable players.
+    - `optimize` enables the extra Huffman-table pass. Off by default: it saves
+      ~3% on a 600px cover but roughly doubles the encode time.
+    - `subsampling` is Pillow's chroma setting: 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0.
+    - Encode through simplejpeg or PyTurboJPEG (libjpeg-turbo) when installed.
     """
 
+    # Already a baseline RGB JPEG within bounds: nothing to normalize, and no
+    # need to even open it.
+    size = _passthrough_jpeg_size(img_bytes, target_width)
+    if size is not None:
+        return JpegCover(img_bytes, size[0], size[1], "RGB")
+
     with Image.open(io.BytesIO(img_bytes)) as im:
+        # Let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding; draft never
+        # goes below the requested size, so LANCZOS still does the final step.
+        if im.format == "JPEG":
+            im.draft("RGB", (target_width * 2, target_width * 2))
+
         try:
             im = ImageOps.exif_transpose(im)
         except Exception:
@@ -142,197 +435,199 @@ def process_image_to_jpeg(img_bytes: bytes, target_width: int = 600, quality: in
         icc_profile = im.info.get("icc_profile")
 
         if im.mode in ("RGBA", "LA"):
+            # An RGBA/LA mask uses its own alpha band, so there is no need to
+            # split() the image into separate band copies first.
             background = Image.new("RGB", im.size, (255, 255, 255))
-            background.paste(im, mask=im.split()[-1])
+            background.paste(im, mask=im)
             im = background
         else:
             im = im.convert("RGB")
 
-        orig_w, orig_h = im.size
-        if orig_w > target_width:
-            target_h = int(target_width * orig_h / orig_w)
-            im = im.resize((target_width, target_h), Image.LANCZOS)
+        # thumbnail() keeps the aspect ratio and is a no-op for small images;
+        # the oversized height bound means only the width is constrained.
+        # reducing_gap=2.0 box-reduces by an integer factor (width //
+        # (2 * target)) with Image.reduce() first, so LANCZOS only runs on the
+        # final, less-than-2x step.
+        im.thumbnail((target_width, 65536), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        # Neither binding can embed an ICC profile, so keep Pillow for those.
+        if simplejpeg is not None and not icc_profile:
+            data = simplejpeg.encode_jpeg(
+                np.asarray(im), quality=quality, colorspace="RGB",
+                colorsubsampling=_SIMPLEJPEG_SUBSAMPLING[subsampling], fastdct=True,
+            )
+            return JpegCover(data, im.width, im.height, im.mode)
+        if _turbojpeg is not None and not icc_profile:
+            # TurboJPEG's TJSAMP_444/422/420 are 0/1/2, same as Pillow's values
+            data = _turbojpeg.encode(
+                np.asarray(im), quality=quality, pixel_format=TJPF_RGB,
+                jpeg_subsample=subsampling, flags=TJFLAG_FASTDCT,
+            )
+            return JpegCover(data, im.width, im.height, im.mode)
 
-        out = io.BytesIO()
+        out = _encode_buffer()
         save_kwargs = {
             "format": "JPEG",
             "quality": quality,
-            "optimize": True,
+            "optimize": optimize,
             "progressive": False,
-            "subsampling": 0,
+            "subsampling": subsampling,
         }
         if icc_profile:
             save_kwargs["icc_profile"] = icc_profile
         im.save(out, **save_kwargs)
-        return out.getvalue()
+        data = out.getbuffer()[:out.tell()].tobytes()
+        return JpegCover(data, im.width, im.height, im.mode)
 
 
-def get_track_number(path: str) -> Optional[int]:
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
-    try:
-        if ext == ".mp3":
-            try:
-                tags = ID3(path)
-            except ID3NoHeaderError:
-                return None
-            trcks = tags.getall("TRCK")
-            if trcks:
-                txt = trcks[0].text[0]
-                m = re.match(r"(\d+)", str(txt))
-                if m:
-                    return int(m.group(1))
-            return None
+def _track_id3(tags) -> Optional[int]:
+    trcks = tags.getall("TRCK")
+    if trcks:
+        m = _LEADING_DIGITS.match(str(trcks[0].text[0]))
+        if m:
+            return int(m.group(1))
+    return None
 
-        elif ext in (".m4a", ".mp4"):
-            mp4 = MP4(path)
-            trkn = mp4.tags.get("trkn")
-            if trkn and len(trkn) and isinstance(trkn[0], (list, tuple)):
-                return int(trkn[0][0])
-            return None
 
-        elif ext == ".flac":
-            fl = FLAC(path)
-            tn = fl.tags.get("tracknumber") or fl.tags.get("TRACKNUMBER")
-            if tn:
-                m = re.match(r"(\d+)", tn[0])
-                if m:
-                    return int(m.group(1))
-            return None
+def _track_mp4(mp4) -> Optional[int]:
+    trkn = mp4.tags.get("trkn")
+    if trkn and len(trkn) and isinstance(trkn[0], (list, tuple)):
+        return int(trkn[0][0])
+    return None
 
-        elif ext in (".ogg", ".opus"):
-            ogg = OggVorbis(path)
-            tn = ogg.get("tracknumber") or ogg.get("TRACKNUMBER")
-            if tn:
-                m = re.match(r"(\d+)", tn[0])
-                if m:
-                    return int(m.group(1))
-            return None
 
-        else:
-            f = File(path)
-            if f is None or not getattr(f, "tags", None):
-                return None
-            for key in ("tracknumber", "TRACKNUMBER", "TRCK", "trkn"):
-                val = None
-                try:
-                    val = f.tags.get(key)
-                except Exception:
-                    pass
-                if val:
-                    if isinstance(val, (list, tuple)):
-                        val = val[0]
-                    m = re.match(r"(\d+)", str(val))
-                    if m:
-                        return int(m.group(1))
-            return None
-    except Exception:
+def _track_flac(fl) -> Optional[int]:
+    tn = fl.tags.get("tracknumber") or fl.tags.get("TRACKNUMBER")
+    if tn:
+        m = _LEADING_DIGITS.match(tn[0])
+        if m:
+            return int(m.group(1))
+    return None
+
+
+def _track_ogg(ogg) -> Optional[int]:
+    tn = ogg.get("tracknumber") or ogg.get("TRACKNUMBER")
+    if tn:
+        m = _LEADING_DIGITS.match(tn[0])
+        if m:
+            return int(m.group(1))
+    return None
+
+
+def _track_generic(f) -> Optional[int]:
+    if f is None or not getattr(f, "tags", None):
         return None
+    for key in ("tracknumber", "TRACKNUMBER", "TRCK", "trkn"):
+        val = None
+        try:
+            val = f.tags.get(key)
+        except Exception:
+            pass
+        if val:
+            if isinstance(val, (list, tuple)):
+                val = val[0]
+            m = _LEADING_DIGITS.match(str(val))
+            if m:
+                return int(m.group(1))
+    return None
 
 
-def get_title(path: str) -> Optional[str]:
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
-    try:
-        if ext == ".mp3":
-            try:
-                tags = ID3(path)
-            except ID3NoHeaderError:
-                return None
-            tit = tags.getall("TIT2")
-            if tit:
-                return str(tit[0].text[0])
-            return None
+def _text_reader(
+    id3_frame: str, mp4_atom: str, vorbis_key: str, generic_keys: Tuple[str, ...],
+) -> Tuple[dict, Callable]:
+    """Build the per-format readers for a plain text tag (title, album, ...)."""
+    def from_id3(tags) -> Optional[str]:
+        frames = tags.getall(id3_frame)
+        if frames:
+            return str(frames[0].text[0])
+        return None
 
-        elif ext in (".m4a", ".mp4"):
-            mp4 = MP4(path)
-            tit = mp4.tags.get("\xa9nam")
-            if tit:
-                return str(tit[0])
-            return None
+    def from_mp4(mp4) -> Optional[str]:
+        val = mp4.tags.get(mp4_atom)
+        if val:
+            return str(val[0])
+        return None
 
-        elif ext == ".flac":
-            fl = FLAC(path)
-            t = fl.tags.get("title") or fl.tags.get("TITLE")
-            if t:
-                return str(t[0])
-            return None
+    def from_flac(fl) -> Optional[str]:
+        val = fl.tags.get(vorbis_key) or fl.tags.get(vorbis_key.upper())
+        if val:
+            return str(val[0])
+        return None
 
-        elif ext in (".ogg", ".opus"):
-            ogg = OggVorbis(path)
-            t = ogg.get("title") or ogg.get("TITLE")
-            if t:
-                return str(t[0])
-            return None
+    def from_ogg(ogg) -> Optional[str]:
+        val = ogg.get(vorbis_key) or ogg.get(vorbis_key.upper())
+        if val:
+            return str(val[0])
+        return None
 
-        else:
-            f = File(path)
-            if f is None or not getattr(f, "tags", None):
-                return None
-            for key in ("title", "TITLE", "TIT2", "\xa9nam"):
-                try:
-                    val = f.tags.get(key)
-                except Exception:
-                    val = None
-                if val:
-                    if isinstance(val, (list, tuple)):
-                        val = val[0]
-                    return str(val)
+    def from_generic(f) -> Optional[str]:
+        if f is None or not getattr(f, "tags", None):
             return None
-    except Exception:
+        for key in generic_keys:
+            try:
+                val = f.tags.get(key)
+            except Exception:
+                val = None
+            if val:
+                if isinstance(val, (list, tuple)):
+                    val = val[0]
+                return str(val)
         return None
 
+    table = {
+        ".mp3": from_id3,
+        ".m4a": from_mp4,
+        ".mp4": from_mp4,
+        ".flac": from_flac,
+        ".ogg": from_ogg,
+        ".opus": from_ogg,
+    }
+    return table, from_generic
 
-def get_album(path: str) -> Optional[str]:
-    """Extract album name from audio file metadata."""
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
+
+_TRACK_READERS = {
+    ".mp3": _track_id3,
+    ".m4a": _track_mp4,
+    ".mp4": _track_mp4,
+    ".flac": _track_flac,
+    ".ogg": _track_ogg,
+    ".opus": _track_ogg,
+}
+_TITLE_READERS, _title_generic = _text_reader(
+    "TIT2", "\xa9nam", "title", ("title", "TITLE", "TIT2", "\xa9nam")
+)
+_ALBUM_READERS, _album_generic = _text_reader(
+    "TALB", "\xa9alb", "album", ("album", "ALBUM", "TALB", "\xa9alb")
+)
+
+
+def get_track_number(path: str, handle=None, ext: Optional[str] = None) -> Optional[int]:
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
     try:
-        if ext == ".mp3":
-            try:
-                tags = ID3(path)
-            except ID3NoHeaderError:
-                return None
-            alb = tags.getall("TALB")
-            if alb:
-                return str(alb[0].text[0])
-            return None
+        tags = handle if handle is not None else _open_tags(path, ext)
+        return _TRACK_READERS.get(ext, _track_generic)(tags)
+    except Exception:
+        return None
 
-        elif ext in (".m4a", ".mp4"):
-            mp4 = MP4(path)
-            alb = mp4.tags.get("\xa9alb")
-            if alb:
-                return str(alb[0])
-            return None
 
-        elif ext == ".flac":
-            fl = FLAC(path)
-            a = fl.tags.get("album") or fl.tags.get("ALBUM")
-            if a:
-                return str(a[0])
-            return None
+def get_title(path: str, handle=None, ext: Optional[str] = None) -> Optional[str]:
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
+    try:
+        tags = handle if handle is not None else _open_tags(path, ext)
+        return _TITLE_READERS.get(ext, _title_generic)(tags)
+    except Exception:
+        return None
 
-        elif ext in (".ogg", ".opus"):
-            ogg = OggVorbis(path)
-            a = ogg.get("album") or ogg.get("ALBUM")
-            if a:
-                return str(a[0])
-            return None
 
-        else:
-            f = File(path)
-            if f is None or not getattr(f, "tags", None):
-                return None
-            for key in ("album", "ALBUM", "TALB", "\xa9alb"):
-                try:
-                    val = f.tags.get(key)
-                except Exception:
-                    val = None
-                if val:
-                    if isinstance(val, (list, tuple)):
-                        val = val[0]
-                    return str(val)
-            return None
+def get_album(path: str, handle=None, ext: Optional[str] = None) -> Optional[str]:
+    """Extract album name from audio file metadata."""
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
+    try:
+        tags = handle if handle is not None else _open_tags(path, ext)
+        return _ALBUM_READERS.get(ext, _album_generic)(tags)
     except Exception:
         return None
 
@@ -340,171 +635,523 @@ def get_album(path: str) -> Optional[str]:
 def sanitize_filename(s: str, maxlen: int = 200) -> str:
     s = str(s)
     s = s.strip()
-    s = s.replace("/", "_").replace("\\\\", "_")
-    s = re.sub(r"[^\w \-\.()\[\]]+", "", s)
-    s = re.sub(r"\s+", " ", s)
+    s = s.translate(_PATH_SEPARATORS)
+    s = _SANITIZE_BAD.sub("", s)
+    s = _SANITIZE_WS.sub(" ", s)
     if len(s) > maxlen:
         s = s[:maxlen].rstrip()
     return s
 
 
-def safe_rename(old_path: str, new_name: str):
+def safe_rename(old_path: str, new_name: str) -> str:
     dirp = os.path.dirname(old_path)
     target = os.path.join(dirp, new_name)
     base, ext = os.path.splitext(new_name)
     count = 1
-    while os.path.exists(target) and os.path.abspath(target) != os.path.abspath(old_path):
+    while os.path.lexists(target) and os.path.abspath(target) != os.path.abspath(old_path):
         target = os.path.join(dirp, f"{base}_{count}{ext}")
         count += 1
 
     try:
-        shutil.move(old_path, target)
+        # Same directory, so a plain rename suffices
+        os.replace(old_path, target)
         return target
     except Exception as e:
         print(f"Failed to rename {old_path} -> {target}: {e}")
         return old_path
 
 
-def embed_cover(path: str, jpeg_bytes: bytes, backup: bool = False):
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
-    print(f"Embedding JPEG cover into: {path}")
+def _reflink(src: str, dst: str) -> bool:
+    """Clone src into a new file dst without copying data (btrfs, XFS, ...).
+
+    The clone is a separate inode, so in-place writes to src never reach it.
+    Returns False if the platform or filesystem cannot clone.
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+        if not cloned:
+            os.remove(dst)
+            return False
+        shutil.copystat(src, dst)
+        return True
+    except OSError:
+        return False
+
+
+def _backup_file(path: str) -> None:
+    """Save a copy as <name>_backup<ext> next to path, unless one exists.
+
+    A hardlink is enough because embed_cover never writes in place (see
+    _save_atomically); the link keeps pointing at the original data.
+    """
+    base, ext = os.path.splitext(path)
+    bak = f"{base}_backup{ext}"
+    if os.path.exists(bak):
+        return
+    try:
+        os.link(path, bak)
+        return
+    except OSError:
+        pass
+    try:
+        if not _reflink(path, bak):
+            shutil.copy2(path, bak)
+    except Exception:
+        pass
+
+
+def _save_atomically(path: str, save: Callable[[str], None], backup: bool = False) -> None:
+    """Apply save(target) to a temporary copy of path, then swap it into place.
+
+    The file is replaced in one os.replace, so an interrupted run never leaves
+    a half-written file and a hardlinked backup keeps the old contents. No
+    per-file fsync; callers flush once at the end of a batch.
 
+    With backup=True the backup is taken only after save() succeeded, right
+    before the swap, so failed embeds leave no stray backup files.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    os.close(fd)
     try:
+        shutil.copyfile(path, tmp)
+        shutil.copymode(path, tmp)
+        save(tmp)
         if backup:
-            base, ext = os.path.splitext(path)
-            bak = f"{base}_backup{ext}"
-            if not os.path.exists(bak):
-                try:
-                    shutil.copy2(path, bak)
-                except Exception:
-                    pass
+            _backup_file(path)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
 
-        if ext == ".mp3":
-            try:
-                tags = ID3(path)
-            except ID3NoHeaderError:
-                tags = ID3()
-            tags.delall("APIC")
-            tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=jpeg_bytes))
-            tags.save(path, v2_version=3)
-
-        elif ext in (".m4a", ".mp4"):
-            mp4 = MP4(path)
-            mp4.tags["covr"] = [MP4Cover(jpeg_bytes, imageformat=MP4Cover.FORMAT_JPEG)]
-            mp4.save()
-
-        elif ext == ".flac":
-            fl = FLAC(path)
-            fl.clear_pictures()
-            p = Picture()
-            p.data = jpeg_bytes
-            p.mime = "image/jpeg"
-            p.type = 3
-            try:
-                p.description = ""
-            except Exception:
-                pass
-            try:
-                im = Image.open(io.BytesIO(jpeg_bytes))
-                p.width, p.height = im.size
-                mode = im.mode
-                if mode == "RGB":
-                    p.depth = 24
-                    p.colors = 0
-                elif mode == "RGBA":
-                    p.depth = 32
-                    p.colors = 0
-                elif mode in ("L", "P"):
-                    p.depth = 8
-                    if mode == "P":
-                        cols = im.getcolors()
-                        p.colors = len(cols) if cols else 0
-                    else:
-                        p.colors = 0
-                else:
-                    p.depth = 24
-                    p.colors = 0
-            except Exception:
-                pass
-            fl.add_picture(p)
-            fl.save()
-
-        elif ext in (".ogg", ".opus"):
-            ogg = OggVorbis(path)
-            p = Picture()
-            p.data = jpeg_bytes
-            p.mime = "image/jpeg"
-            p.type = 3
-            try:
-                p.description = ""
-            except Exception:
-                pass
-            try:
-                im = Image.open(io.BytesIO(jpeg_bytes))
-                p.width, p.height = im.size
-                mode = im.mode
-                if mode == "RGB":
-                    p.depth = 24
-                    p.colors = 0
-                elif mode == "RGBA":
-                    p.depth = 32
-                    p.colors = 0
-                elif mode in ("L", "P"):
-                    p.depth = 8
-                    if mode == "P":
-                        cols = im.getcolors()
-                        p.colors = len(cols) if cols else 0
-                    else:
-                        p.colors = 0
-                else:
-                    p.depth = 24
-                    p.colors = 0
-            except Exception:
-                pass
-            raw = p.write()
-            b64 = base64.b64encode(raw).decode("ascii")
-            ogg.tags["METADATA_BLOCK_PICTURE"] = [b64]
-            ogg.save()
 
-        else:
-            f = File(path)
-            if f is None:
-                print(f"Cannot open file for embedding: {path}")
-                return
-            try:
-                tags = ID3(path)
-                tags.delall("APIC")
-                tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=jpeg_bytes))
-                tags.save(path, v2_version=3)
-                return
-            except Exception:
-                pass
-            print(f"No embedding handler for extension {ext} (file: {path})")
+def _cover_picture(jpeg_bytes: bytes, width: int, height: int, mode: str) -> Picture:
+    """FLAC-style front-cover Picture block, as used by FLAC and Ogg."""
+    p = Picture()
+    p.data = jpeg_bytes
+    p.mime = "image/jpeg"
+    p.type = 3
+    try:
+        p.description = ""
+    except Exception:
+        pass
+    p.width, p.height = width, height
+    p.depth = _PICTURE_DEPTH.get(mode, 24)
+    p.colors = 0  # JPEG has no palette
+    return p
+
+
+def _embed_mp3(
+    path: str, tags, jpeg_bytes: bytes, width: int, height: int, mode: str,
+) -> Optional[Callable[[str], None]]:
+    tags.delall("APIC")
+    tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=jpeg_bytes))
+    return lambda target: tags.save(target, v2_version=3)
+
+
+def _embed_mp4(
+    path: str, mp4, jpeg_bytes: bytes, width: int, height: int, mode: str,
+) -> Optional[Callable[[str], None]]:
+    mp4.tags["covr"] = [MP4Cover(jpeg_bytes, imageformat=MP4Cover.FORMAT_JPEG)]
+    return mp4.save
+
+
+def _embed_flac(
+    path: str, fl, jpeg_bytes: bytes, width: int, height: int, mode: str,
+) -> Optional[Callable[[str], None]]:
+    fl.clear_pictures()
+    p = _cover_picture(jpeg_bytes, width, height, mode)
+    fl.add_picture(p)
+    return fl.save
+
+
+def _embed_ogg(
+    path: str, ogg, jpeg_bytes: bytes, width: int, height: int, mode: str,
+) -> Optional[Callable[[str], None]]:
+    p = _cover_picture(jpeg_bytes, width, height, mode)
+    raw = p.write()
+    b64 = binascii.b2a_base64(raw, newline=False).decode("ascii")
+    ogg.tags["METADATA_BLOCK_PICTURE"] = [b64]
+    return ogg.save
+
+
+def _embed_generic(
+    path: str, f, jpeg_bytes: bytes, width: int, height: int, mode: str,
+) -> Optional[Callable[[str], None]]:
+    if f is None:
+        print(f"Cannot open file for embedding: {path}")
+        return None
+    try:
+        tags = ID3(path)
+    except Exception:
+        print(f"No embedding handler for extension {os.path.splitext(path)[1]} (file: {path})")
+        return None
+    return _embed_mp3(path, tags, jpeg_bytes, width, height, mode)
+
+
+# Each writer puts the cover into the parsed tags and returns the save(target)
+# callable for _save_atomically, or None if the file cannot take a cover.
+_COVER_WRITERS = {
+    ".mp3": _embed_mp3,
+    ".m4a": _embed_mp4,
+    ".mp4": _embed_mp4,
+    ".flac": _embed_flac,
+    ".ogg": _embed_ogg,
+    ".opus": _embed_ogg,
+}
+
+
+def _sole_picture(pictures) -> Optional[bytes]:
+    # APIC frames and FLAC Picture blocks share type/mime/desc/data
+    if len(pictures) != 1:
+        return None
+    p = pictures[0]
+    if p.type != 3 or p.mime != "image/jpeg" or p.desc:
+        return None
+    return p.data
+
+
+def _sole_cover_mp3(tags) -> Optional[bytes]:
+    return _sole_picture(tags.getall("APIC"))
+
+
+def _sole_cover_mp4(mp4) -> Optional[bytes]:
+    covr = mp4.tags.get("covr") if mp4.tags is not None else None
+    if not covr or len(covr) != 1 or covr[0].imageformat != MP4Cover.FORMAT_JPEG:
+        return None
+    return covr[0]
+
+
+def _sole_cover_flac(fl) -> Optional[bytes]:
+    return _sole_picture(fl.pictures)
+
+
+def _sole_cover_ogg(ogg) -> Optional[bytes]:
+    if ogg.tags is None:
+        return None
+    blocks = ogg.tags.get("metadata_block_picture") or []
+    pictures = []
+    for b64 in blocks:
+        try:
+            pictures.append(Picture(binascii.a2b_base64(b64)))
+        except Exception:
+            return None
+    return _sole_picture(pictures)
+
+
+# Each reader returns the cover bytes only if the file already holds exactly
+# what the matching writer would leave: one front cover (type 3), image/jpeg,
+# no description. Anything else still needs a save to normalize it.
+_SOLE_COVER_READERS = {
+    ".mp3": _sole_cover_mp3,
+    ".m4a": _sole_cover_mp4,
+    ".mp4": _sole_cover_mp4,
+    ".flac": _sole_cover_flac,
+    ".ogg": _sole_cover_ogg,
+    ".opus": _sole_cover_ogg,
+}
+
+
+def _sole_front_cover(handle, ext: str) -> Optional[bytes]:
+    """The file's cover bytes if it needs no normalizing, otherwise None."""
+    reader = _SOLE_COVER_READERS.get(ext)
+    if reader is None or handle is None:
+        return None
+    try:
+        return reader(handle)
+    except Exception:
+        return None
+
+
+def embed_cover(
+    path: str, jpeg_bytes: bytes, width: int, height: int, mode: str,
+    backup: bool = False, handle=None, ext: Optional[str] = None,
+) -> bool:
+    """Embed jpeg_bytes as the front cover. Returns True once the file carries it.
+
+    width/height/mode describe the encoded image (see JpegCover) and fill the
+    FLAC/Ogg picture block without decoding the JPEG again.
+
+    `handle` may be the object _open_tags(path) returns; it is updated and
+    saved. `ext` is path's lower-cased extension if the caller has it.
+
+    A file whose only picture is already a type 3 image/jpeg cover
+    byte-identical to jpeg_bytes is left alone: saving would rewrite the
+    whole audio file for nothing.
+    """
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
+
+    try:
+        tags = handle if handle is not None else _open_tags(path, ext)
+        if _sole_front_cover(tags, ext) == jpeg_bytes:
+            return True
+
+        writer = _COVER_WRITERS.get(ext, _embed_generic)
+        save = writer(path, tags, jpeg_bytes, width, height, mode)
+        if save is None:
+            return False
+        _save_atomically(path, save, backup=backup)
+        return True
 
     except Exception as e:
         print(f"Error embedding cover into {path}: {e}")
+        return False
+
+
+def _marker_key(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _marker_index_path(path: str) -> str:
+    """JSON index used when extended attributes are unavailable (one per directory)."""
+    folder = os.path.abspath(os.path.dirname(path))
+    digest = hashlib.sha1(folder.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(_MARKER_CACHE_DIR, f"{digest}.json")
+
+
+def _read_marker(path: str) -> Optional[str]:
+    if hasattr(os, "getxattr"):
+        try:
+            return os.getxattr(path, _MARKER_XATTR).decode("ascii")
+        except OSError:
+            pass
+    try:
+        with open(_marker_index_path(path), encoding="utf-8") as f:
+            return json.load(f).get(os.path.basename(path))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_marker(path: str) -> None:
+    """Record the file's current size/mtime as already normalized."""
+    try:
+        key = _marker_key(path)
+    except OSError:
+        return
+    if hasattr(os, "setxattr"):
+        try:
+            os.setxattr(path, _MARKER_XATTR, key.encode("ascii"))
+            return
+        except OSError:
+            pass
+    # Fallback index. Concurrent writers may drop each other's entries, which
+    # only means a file gets processed again next time.
+    index_path = _marker_index_path(path)
+    try:
+        os.makedirs(_MARKER_CACHE_DIR, exist_ok=True)
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index[os.path.basename(path)] = key
+        tmp = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, index_path)
+    except OSError:
+        pass
+
+
+def _is_unchanged(path: str) -> bool:
+    """True if the file has not changed since its cover was last normalized."""
+    try:
+        return _read_marker(path) == _marker_key(path)
+    except OSError:
+        return False
+
+
+def _seen_db() -> sqlite3.Connection:
+    """Per-thread connection to the database of covers this tool has written."""
+    conn = getattr(_seen, "conn", None)
+    if conn is None:
+        os.makedirs(_MARKER_CACHE_DIR, exist_ok=True)
+        conn = sqlite3.connect(_SEEN_DB, timeout=5, isolation_level=None)
+        conn.execute("CREATE TABLE IF NOT EXISTS covers (digest BLOB PRIMARY KEY)")
+        _seen.conn = conn
+    return conn
+
+
+def _cover_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _is_known_cover(data: bytes) -> bool:
+    """True if data is a cover an earlier run produced and embedded.
+
+    Catches files whose marker no longer matches (retagged, touched, copied)
+    but whose cover is still ours, without decoding it again.
+    """
+    try:
+        row = _seen_db().execute(
+            "SELECT 1 FROM covers WHERE digest = ?", (_cover_digest(data),)
+        ).fetchone()
+    except (sqlite3.Error, OSError):
+        return False
+    return row is not None
+
+
+def _remember_cover(data: bytes) -> None:
+    try:
+        _seen_db().execute(
+            "INSERT OR IGNORE INTO covers (digest) VALUES (?)", (_cover_digest(data),)
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@contextlib.contextmanager
+def _open_for_scan(path: str) -> Iterator[IO[bytes] | mmap.mmap]:
+    """Open path read-only for a tag scan, memory-mapped once it is big enough.
+
+    Small files are cheaper to read() than to map.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _MMAP_MIN_SIZE:
+            yield f
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
+
+
+def _read_album_tag(path: str) -> Optional[str]:
+    """Return the album tag, reading no more of the file than needed.
+
+    FLAC parses only the VORBIS_COMMENT block, MP3 decodes only the TALB
+    frame and MP4 reads only the \xa9alb atom, so embedded pictures are never
+    copied out. Anything these fast paths cannot handle uses get_album().
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == ".flac":
+            return _read_flac_album(path)
+        if ext == ".mp3":
+            return _read_mp3_album(path)
+        if ext in (".m4a", ".mp4"):
+            return _read_mp4_album(path)
+    except Exception:
+        return None
+    return get_album(path, ext=ext)
+
+
+def _read_flac_album(path: str) -> Optional[str]:
+    # STREAMINFO, SEEKTABLE, PICTURE and other blocks are skipped with a
+    # relative seek. A leading ID3 tag sends us to get_album().
+    with _open_for_scan(path) as f:
+        if f.read(4) != b"fLaC":
+            return get_album(path)
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return None
+            size = int.from_bytes(header[1:], "big")
+            if header[0] & 0x7F == _FLAC_VORBIS_COMMENT:
+                a = VCFLACDict(f.read(size)).get("album")
+                return str(a[0]) if a else None
+            if header[0] & 0x80:  # last metadata block
+                return None
+            f.seek(size, 1)
+
+
+def _read_mp3_album(path: str) -> Optional[str]:
+    # Every other frame (APIC included) stays an undecoded blob. ID3v2.2
+    # stores the album as TAL, which mutagen upgrades to TALB on load.
+    try:
+        with _open_for_scan(path) as f:
+            tags = ID3(f, known_frames={"TALB": TALB, "TAL": TAL})
+    except ID3NoHeaderError:
+        return None
+    alb = tags.getall("TALB")
+    return str(alb[0].text[0]) if alb and alb[0].text else None
+
+
+def _find_atom(f, end: int, name: bytes) -> Optional[Tuple[int, int]]:
+    """(payload start, atom end) of the first `name` atom from f.tell() to end."""
+    pos = f.tell()
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        size = int.from_bytes(header[:4], "big")
+        start = pos + 8
+        if size == 1:  # 64-bit size follows the name
+            large = f.read(8)
+            if len(large) < 8:
+                return None
+            size = int.from_bytes(large, "big")
+            start += 8
+        elif size == 0:  # extends to the end of its parent
+            size = end - pos
+        if size < start - pos or pos + size > end:
+            return None
+        if header[4:8] == name:
+            return start, pos + size
+        pos += size
+    return None
+
+
+_MP4_ALBUM_PATH = (b"moov", b"udta", b"meta", b"ilst", b"\xa9alb")
+
+
+def _read_mp4_album(path: str) -> Optional[str]:
+    # Only atom headers are read on the way down; the covr payload is skipped.
+    end = os.path.getsize(path)
+    with _open_for_scan(path) as f:
+        for name in _MP4_ALBUM_PATH:
+            found = _find_atom(f, end, name)
+            if found is None:
+                return None
+            start, end = found
+            if name == b"meta":
+                start += 4  # full box: version and flags come before children
+            f.seek(start)
+        payload = f.read(end - start)
+    # First child is a 'data' atom: size, name, version + type, locale, text.
+    # Anything but type 1 (UTF-8), e.g. UTF-16, is left to get_album().
+    if payload[4:8] != b"data" or payload[8:12] != b"\x00\x00\x00\x01":
+        return get_album(path)
+    size = int.from_bytes(payload[:4], "big")
+    return payload[16:size].decode("utf-8", "replace") or None
 
 
 def get_majority_album(folder_path: str) -> Optional[str]:
-    """Analyze all audio files in a folder and return the most common album name."""
+    """Analyze all audio files in a folder and return the most common album name.
+
+    Stops reading tags once the leader can no longer be caught by the files
+    that are left, which gives the same answer as a full scan.
+    """
     from collections import Counter
     
-    albums = []
-    for file_path in find_audio_files(folder_path, DEFAULT_EXTENSIONS):
-        # Only check files directly in this folder (not subdirectories)
-        if os.path.dirname(file_path) == os.path.abspath(folder_path):
-            album = get_album(file_path)
-            if album and album.strip():
-                albums.append(album.strip())
+    # Only check files directly in this folder (not subdirectories)
+    files = list(find_audio_files(folder_path, DEFAULT_EXTENSIONS, recursive=False))
     
-    if not albums:
+    counter: Counter[str] = Counter()
+    for i, file_path in enumerate(files):
+        album = _read_album_tag(file_path)
+        if album and album.strip():
+            counter[album.strip()] += 1
+            leaders = counter.most_common(2)
+            runner_up = leaders[1][1] if len(leaders) > 1 else 0
+            if leaders[0][1] - runner_up > len(files) - i - 1:
+                break
+    
+    if not counter:
         return None
     
     # Get the most common album name
-    counter = Counter(albums)
-    most_common = counter.most_common(1)[0]
-    return most_common[0]
+    return counter.most_common(1)[0][0]
 
 
 def rename_folder_by_album(folder_path: str) -> tuple:
@@ -513,6 +1160,16 @@ def rename_folder_by_album(folder_path: str) -> tuple:
     """
     try:
         album = get_majority_album(folder_path)
+    except Exception as e:
+        return ("error", folder_path, str(e))
+    return rename_folder_to_album(folder_path, album)
+
+
+def rename_folder_to_album(folder_path: str, album: Optional[str]) -> tuple:
+    """Rename folder to an already-resolved album name.
+    Returns (status, old_path, new_path_or_message).
+    """
+    try:
         if not album:
             return ("skipped", folder_path, "no album metadata found")
         
@@ -548,45 +1205,226 @@ def rename_folder_by_album(folder_path: str) -> tuple:
         return ("error", folder_path, str(e))
 
 
+def _syncsafe(b: bytes) -> int:
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+def _fast_mp3_trck_tit2(path: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Read just the TRCK and TIT2 text of an ID3v2.3/2.4 tag.
+
+    Walks the frame headers and seeks past every other frame, so pictures and
+    the rest of the tag are never read. Returns (track, title) with None for
+    an absent frame, or None for tags that need mutagen: no ID3v2 header,
+    v2.2, unsynchronisation, an extended header, or compressed/encrypted
+    frames.
+    """
+    with open(path, "rb") as f:
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b"ID3" or header[3] not in (3, 4):
+            return None
+        if header[5] & 0xC0:  # unsynchronisation / extended header
+            return None
+        v4 = header[3] == 4
+        unsupported = 0x4F if v4 else 0xE0  # per-frame grouping/compression/...
+        end = 10 + _syncsafe(header[6:10])
+        found: dict[bytes, str] = {}
+        pos = 10
+        while pos + 10 <= end and len(found) < 2:
+            frame = f.read(10)
+            if len(frame) < 10 or frame[0] == 0:  # EOF or padding
+                break
+            size = _syncsafe(frame[4:8]) if v4 else int.from_bytes(frame[4:8], "big")
+            if pos + 10 + size > end:
+                return None
+            if frame[:4] in (b"TRCK", b"TIT2"):
+                if frame[9] & unsupported:
+                    return None
+                body = f.read(size)
+                if not body or body[0] >= len(_ID3_TEXT_CODECS):
+                    return None
+                text = body[1:].decode(_ID3_TEXT_CODECS[body[0]], "replace")
+                found[frame[:4]] = text.split("\x00", 1)[0]
+            else:
+                f.seek(size, 1)
+            pos += 10 + size
+    return found.get(b"TRCK"), found.get(b"TIT2")
+
+
+@dataclass
+class TagBundle:
+    """One file's parsed tags, shared by the tag helpers.
+
+    The file is opened on first use of `handle`, so a caller that ends up
+    reading nothing never parses it. If parsing fails, `handle` is None and
+    the helpers fall back to opening the path themselves.
+    """
+    path: str
+    ext: str
+    preread: bool = False
+    _handle: object = field(default=None, repr=False)
+    _loaded: bool = field(default=False, repr=False)
+    _id3_text: Optional[Tuple[Optional[str], Optional[str]]] = field(default=None, repr=False)
+
+    @property
+    def handle(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                self._handle = _open_tags(self.path, self.ext, self.preread)
+            except Exception:
+                self._handle = None
+        return self._handle
+
+    def cover(self) -> Optional[Tuple[bytes, str]]:
+        return extract_cover_bytes(self.path, self.handle, self.ext)
+
+    def _fast_id3(self) -> Tuple[Optional[str], Optional[str]]:
+        # Only for MP3s nobody has parsed (or pre-read) yet; once mutagen has
+        # the tag, asking it is cheaper than reading the file again.
+        if self.ext != ".mp3" or self._loaded or self.preread:
+            return None, None
+        if self._id3_text is None:
+            try:
+                self._id3_text = _fast_mp3_trck_tit2(self.path) or (None, None)
+            except OSError:
+                self._id3_text = (None, None)
+        return self._id3_text
+
+    def track_number(self) -> Optional[int]:
+        text = self._fast_id3()[0]
+        if text is not None:
+            m = _LEADING_DIGITS.match(text)
+            if m:
+                return int(m.group(1))
+        return get_track_number(self.path, self.handle, self.ext)
+
+    def title(self) -> Optional[str]:
+        text = self._fast_id3()[1]
+        if text is not None:
+            return text
+        return get_title(self.path, self.handle, self.ext)
+
+    def album(self) -> Optional[str]:
+        return get_album(self.path, self.handle, self.ext)
+
+
+_cover_cache: collections.OrderedDict = collections.OrderedDict()
+_cover_cache_lock = threading.Lock()
+_COVER_CACHE_SIZE = 256
+
+
+def _process_image_cached(
+    img_bytes: bytes, quality: int, optimize: bool, subsampling: int,
+) -> JpegCover:
+    """process_image_to_jpeg memoized on the source image's content hash.
+
+    The tracks of an album usually share one cover, so each worker decodes,
+    resizes and encodes it once. The cache is per process: shipping results
+    between pool workers would cost more than the encode it saves.
+    """
+    key = (_cover_digest(img_bytes), quality, optimize, subsampling)
+    with _cover_cache_lock:
+        cover = _cover_cache.get(key)
+        if cover is not None:
+            _cover_cache.move_to_end(key)
+            return cover
+    cover = process_image_to_jpeg(
+        img_bytes, quality=quality, optimize=optimize, subsampling=subsampling
+    )
+    with _cover_cache_lock:
+        _cover_cache[key] = cover
+        if len(_cover_cache) > _COVER_CACHE_SIZE:
+            _cover_cache.popitem(last=False)
+    return cover
+
+
+def load_tags(path: str, preread: bool = False) -> TagBundle:
+    """Return a TagBundle for path (see _open_tags for preread)."""
+    return TagBundle(path, os.path.splitext(path)[1].lower(), preread)
+
+
 def process_path(path: str, args) -> tuple:
     """Worker to process a single file. Returns (status, path, message).
     status: 'processed', 'skipped', 'error'
     """
     try:
         did_something = False
+        embedded = False
+        unchanged = False
         new_path = path
         
-        # Handle embedding if requested
-        if getattr(args, "do_embed", True):
-            info = extract_cover_bytes(path)
-            if info:
+        # Parse tags at most once and share them between the embed and rename
+        # steps instead of re-opening the file for every read.
+        tags = load_tags(path, preread=getattr(args, "do_embed", True))
+        
+        # Read everything the rename needs before the embed mutates the handle
+        if getattr(args, "do_rename", False):
+            track = tags.track_number()
+            title = tags.title() if track is not None else None
+        
+        # Handle embedding if requested: encode now, write after the rename
+        cover = None
+        if getattr(args, "do_embed", True) and _is_unchanged(path):
+            # Cover was normalized by an earlier run and the file is untouched
+            if not getattr(args, "do_rename", False):
+                return ("skipped", path, "unchanged")
+            unchanged = True
+        elif getattr(args, "do_embed", True):
+            info = tags.cover()
+            if (
+                info and _is_known_cover(info[0])
+                and _sole_front_cover(tags.handle, tags.ext) is not None
+            ):
+                # An earlier run wrote this cover as the file's only picture;
+                # only the marker went stale
+                _write_marker(path)
+                if not getattr(args, "do_rename", False):
+                    return ("skipped", path, "already processed")
+                unchanged = True
+            elif info:
                 img_bytes, mime = info
-                jpeg = process_image_to_jpeg(img_bytes)
-                embed_cover(path, jpeg, backup=getattr(args, "backup", False))
-                did_something = True
+                cover = _process_image_cached(
+                    img_bytes,
+                    quality=getattr(args, "jpeg_quality", 90),
+                    optimize=getattr(args, "jpeg_optimize", False),
+                    subsampling=getattr(args, "jpeg_subsampling", 2),
+                )
             # If no cover but embed was requested, just skip the embed part
             # (don't fail the whole operation if rename is also requested)
         
-        # Handle renaming if requested
+        # Handle renaming if requested. The rename is a cheap directory
+        # operation, so it goes first and the embed saves the file once under
+        # its final name.
         if getattr(args, "do_rename", False):
-            track = get_track_number(path)
             if track is not None:
-                title = get_title(path) or os.path.splitext(os.path.basename(path))[0]
+                title = title or os.path.splitext(os.path.basename(path))[0]
                 title = sanitize_filename(title)
                 base_new = f"{int(track):02d}. {title}"
-                ext = os.path.splitext(path)[1]
-                new_name = base_new + ext
+                new_name = base_new + os.path.splitext(path)[1]
                 new_path = safe_rename(path, new_name)
-                print(f"Renamed to: {new_path}")
+                tags.path = new_path
                 did_something = True
             else:
                 # Only fail if ONLY rename was requested and no track number
                 if not getattr(args, "do_embed", True):
                     return ("skipped", path, "no track number metadata")
         
+        if cover is not None:
+            embedded = embed_cover(
+                new_path, cover.data, cover.width, cover.height, cover.mode,
+                backup=getattr(args, "backup", False), handle=tags.handle, ext=tags.ext,
+            )
+            if not embedded:
+                return ("error", new_path, "embed failed")
+            _remember_cover(cover.data)
+            _write_marker(new_path)
+            did_something = True
+        
         # If we were supposed to do something but couldn't
         if not did_something:
-            if getattr(args, "do_embed", True) and not getattr(args, "do_rename", False):
+            if unchanged:
+                return ("skipped", path, "unchanged")
+            elif getattr(args, "do_embed", True) and not getattr(args, "do_rename", False):
                 return ("skipped", path, "no embedded cover")
             elif getattr(args, "do_rename", False) and not getattr(args, "do_embed", True):
                 return ("skipped", path, "no track number metadata")
@@ -596,3 +1434,30 @@ def process_path(path: str, args) -> tuple:
         return ("processed", new_path, "ok")
     except Exception as e:
         return ("error", path, str(e))
+
+
+def process_paths(
+    paths: Iterable[str], args, workers: Optional[int] = None,
+) -> Iterator[tuple]:
+    """Run process_path over paths in parallel, yielding results in input order.
+
+    Embedding is CPU-bound (decode/resize/encode) and fans out over processes;
+    rename-only runs are I/O-bound and use threads. `args` must be picklable.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for path in paths:
+            yield process_path(path, args)
+        return
+
+    pool: concurrent.futures.Executor
+    if getattr(args, "do_embed", True):
+        if sys.platform == "win32":
+            # ProcessPoolExecutor rejects more than 61 workers on Windows
+            workers = min(workers, _WIN32_MAX_PROCESS_WORKERS)
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    with pool as executor:
+        # chunksize amortizes pickling/IPC per task for the process pool
+        yield from executor.map(process_path, paths, itertools.repeat(args), chunksize=16)